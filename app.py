@@ -1,18 +1,171 @@
 import streamlit as st
 import re
+import functools
+import threading
 import io  # Import io module
+from bisect import bisect_left
+from collections import defaultdict
 from difflib import SequenceMatcher
 
+try:  # Optional C implementation of the same ratio, much faster than SequenceMatcher
+    from rapidfuzz.fuzz import ratio as _rf_ratio
+except ImportError:
+    _rf_ratio = None
+
+# Hunk header, e.g. "@@ -12,5 +12,6 @@ def foo():" (counts are optional)
+_HUNK_HEADER_RE = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# How far (in lines) a hunk may be moved from its header position when the original has drifted
+_MAX_HUNK_OFFSET = 100
+# Hunk line kinds, stored as the byte value of the line's prefix character
+_CONTEXT, _ADDED, _REMOVED = ord(" "), ord("+"), ord("-")
+# Warning kinds recorded in mismatches and turned into messages by _format_mismatch
+_MISMATCH_HEADER, _MISMATCH_CONTEXT, _MISMATCH_REMOVAL = "header", "context", "removal"
+# Holds the per-thread SequenceMatcher used when rapidfuzz isn't available
+_matcher_local = threading.local()
+
 def is_line_similar(line1, line2, ratio_threshold=0.8):
     """Checks if two lines are similar based on SequenceMatcher ratio."""
-    if not line1.strip() and not line2.strip(): # Consider empty lines as similar
+    s1, s2 = line1.strip(), line2.strip()
+    if s1 == s2: # Identical (or both empty) lines are always similar
         return True
-    if not line1.strip() or not line2.strip(): # If one is empty and the other is not, not similar enough unless both are empty
+    if not s1 or not s2: # If one is empty and the other is not, not similar enough unless both are empty
+        return False
+    if s1 > s2: # Order the pair so (a, b) and (b, a) share a cache entry
+        s1, s2 = s2, s1
+    return _is_stripped_similar(s1, s2, ratio_threshold)
+
+@functools.lru_cache(maxsize=8192)
+def _is_stripped_similar(s1, s2, ratio_threshold):
+    """Similarity check for two stripped, non-equal, non-empty lines. Memoized since boilerplate context lines repeat."""
+    # The ratio is 2*M/(len1+len2) and M can't exceed the shorter length, so this bound rejects cheaply
+    la, lb = len(s1), len(s2)
+    if 2 * min(la, lb) / (la + lb) < ratio_threshold:
         return False
-    matcher = SequenceMatcher(None, line1.strip(), line2.strip())
+    if _rf_ratio is not None:
+        return _rf_ratio(s1, s2, score_cutoff=ratio_threshold * 100) >= ratio_threshold * 100
+    matcher = _thread_matcher()
+    matcher.set_seqs(s1, s2)
     return matcher.ratio() >= ratio_threshold
 
+def _thread_matcher():
+    """Returns a SequenceMatcher reused across calls. One per thread, as Streamlit runs each session in its own thread."""
+    matcher = getattr(_matcher_local, "matcher", None)
+    if matcher is None:
+        matcher = _matcher_local.matcher = SequenceMatcher(None, autojunk=False)
+    return matcher
+
 # --- Logic Functions ---
+def _format_mismatch(kind, line_number, payload):
+    """Turns a recorded mismatch into a warning line: context/removal ones come from _apply_hunk, header count ones from apply_diff_logic_smart."""
+    if kind == _MISMATCH_HEADER:
+        return f"Hunk line counts don't match its header '{payload}' (Hunk starts near line {line_number}). Diff may be truncated or edited by hand."
+    if kind == _MISMATCH_CONTEXT:
+        return f"Context line mismatch, using diff line anyway: '{payload.strip()}' (Expected near line {line_number}). Potential patching issue."
+    return f"Removal line context mismatch, skipping original line but applying removal from diff: '-{payload.rstrip()}' (Expected near line {line_number}). Potential patching issue."
+
+def _apply_hunk(hunk, original_lines, original_stripped, original_line_index, original_start_line, output, mismatches, newline="\n"):
+    """
+    Applies a single parsed hunk starting at original_line_index, writing the result to output.
+    Lines taken from the diff are written with newline, the original's line ending.
+
+    Kept free of diff parsing and Streamlit state so it can be called on its own when patching in bulk.
+    Mismatches are appended to mismatches as (kind, line_number, payload) and only formatted by _format_mismatch.
+
+    Returns:
+        int: the index of the first original line after the hunk
+    """
+    original_line_count = len(original_lines)
+    for hunk_lines_index, (kind, payload) in enumerate(zip(hunk["kinds"], hunk["payloads"])):
+        if kind == _CONTEXT:  # Context line
+            # Exact matches are the common case, only fall back to the fuzzy check on a mismatch
+            if original_line_index < original_line_count and (
+                original_stripped[original_line_index] == payload
+                or is_line_similar(original_stripped[original_line_index], payload)
+            ):
+                output.write(original_lines[original_line_index])
+                original_line_index += 1
+            else:
+                mismatches.append((_MISMATCH_CONTEXT, original_start_line + 1 + hunk_lines_index, payload))
+                output.write(payload + newline) # Apply diff line even if context mismatch
+
+
+        elif kind == _ADDED:  # Added line
+            # Payloads end in "\n", so only other line endings need a new string
+            output.write(payload if newline == "\n" else payload[:-1] + newline)
+
+        elif kind == _REMOVED:  # Removed line
+            if original_line_index < original_line_count and original_stripped[original_line_index] != payload:
+                mismatches.append((_MISMATCH_REMOVAL, original_start_line + 1 + hunk_lines_index, payload))
+            original_line_index += 1 # Always try to skip original line for removal, even with mismatch
+
+    return original_line_index
+
+def _build_line_index(original_stripped):
+    """Maps each original line's text to the sorted list of indices where it occurs (like difflib's b2j)."""
+    line_index = defaultdict(list)
+    for i, line in enumerate(original_stripped):
+        line_index[line].append(i)
+    return line_index
+
+def _hunk_anchor(hunk):
+    """
+    Finds the first non-blank context or removal line of a hunk, used to locate the hunk in the original.
+
+    Returns:
+        tuple: (offset, text) where offset is the line's position among the hunk's original-side lines, or None
+    """
+    offset = 0
+    for kind, payload in zip(hunk["kinds"], hunk["payloads"]):
+        if kind != _ADDED:
+            if payload.strip():
+                return offset, payload
+            offset += 1
+    return None
+
+def _hunk_matches_at(hunk, original_stripped, start, fuzzy=False):
+    """
+    Checks that the hunk's context and removal lines match the original from start on. Removal lines must always
+    match exactly (as _apply_hunk checks them), context lines may also just be similar when fuzzy is set.
+    """
+    i = start
+    for kind, payload in zip(hunk["kinds"], hunk["payloads"]):
+        if kind == _ADDED:
+            continue
+        if i < 0 or i >= len(original_stripped):
+            return False
+        actual = original_stripped[i]
+        if actual != payload and not (fuzzy and kind == _CONTEXT and is_line_similar(actual, payload)):
+            return False
+        i += 1
+    return True
+
+def _locate_hunk(hunk, line_index, original_stripped, original_start_line, original_line_index):
+    """
+    Looks for a hunk that doesn't match exactly at its header position, in the order `patch -F` does: exact matches at
+    occurrences of its anchor line (closest first), then a fuzzy match at the header position, then fuzzy at the occurrences.
+    Occurrences before original_line_index (already consumed by earlier hunks) or further than _MAX_HUNK_OFFSET away are ignored.
+
+    Returns:
+        int: the corrected 0-indexed start of the hunk, or original_start_line if no matching position was found
+    """
+    anchor = _hunk_anchor(hunk)
+    starts = []
+    if anchor is not None:
+        offset, text = anchor
+        positions = line_index.get(text, [])
+        expected = original_start_line + offset
+        window = positions[bisect_left(positions, expected - _MAX_HUNK_OFFSET):bisect_left(positions, expected + _MAX_HUNK_OFFSET + 1)]
+        starts = [p - offset for p in sorted(window, key=lambda p: abs(p - expected)) if p - offset >= original_line_index]
+    for start in starts:
+        if _hunk_matches_at(hunk, original_stripped, start):
+            return start
+    if _hunk_matches_at(hunk, original_stripped, original_start_line, fuzzy=True):
+        return original_start_line
+    for start in starts:
+        if _hunk_matches_at(hunk, original_stripped, start, fuzzy=True):
+            return start
+    return original_start_line
+
 def apply_diff_logic_smart(diff_content, original_content, filename=None):
     """
     Applies a unified diff to a string of original content with more flexible context matching.
@@ -20,7 +173,7 @@ def apply_diff_logic_smart(diff_content, original_content, filename=None):
     Args:
         diff_content (str): The content of the diff in unified format.
         original_content (str): The original content to apply the diff to.
-        filename (str, optional): The filename to be patched (for diff parsing only).
+        filename (str, optional): The filename to be patched (for reference only, not used when patching).
 
     Returns:
         tuple: (success_message, warning_message, modified_content_string)
@@ -28,98 +181,131 @@ def apply_diff_logic_smart(diff_content, original_content, filename=None):
                warning_message: str if warnings occurred, None otherwise (can also be error message in case of fatal error)
                modified_content_string: str of the modified content or None if error
     """
-    diff_lines = diff_content.strip().splitlines()
-    if not diff_lines:
-        return None, "Error: Empty diff content provided.", None, None # Return None for modified_content in error case
+    diff_content = diff_content.strip()
+    if not diff_content:
+        return None, "Error: Empty diff content provided.", None # Return None for modified_content in error case
 
-    target_filename = None
     hunks = []
     current_hunk = None
+    remaining_original = remaining_modified = 0  # Lines the current hunk's header still expects on each side
+    # Split on "\n" only (splitlines() would also break on form feeds etc.) and keep it, so added lines can be
+    # emitted as-is; this also restores the newline strip() removed from the last line
+    diff_lines = [line + "\n" for line in diff_content.split("\n")]
 
     # Parse the diff content
-    for line in diff_lines:
-        if line.startswith("+++ b/"):
-            target_filename = line[6:]
-            if filename and target_filename != filename:
-                filename = filename
-            elif not filename:
-                filename = target_filename
+    for line_number, line in enumerate(diff_lines):
+        if line[:6] == "+++ b/": # File header, the content is patched in memory so the name isn't needed
             continue
 
-        if line.startswith("@@"):
+        if line[:2] == "@@":
+            header = line.rstrip("\r\n")
+            header_match = _HUNK_HEADER_RE.match(header)
+            if not header_match:
+                return None, f"Warning: Invalid hunk header: '{header}'. Skipping hunk.", None # Return None for modified_content in error case
             if current_hunk:
                 hunks.append(current_hunk)
-            current_hunk = {"header": line, "lines": []}
+            current_hunk = {
+                "header": header,
+                "original_start": int(header_match.group(1)) - 1,  # 0-indexed
+                "original_count": int(header_match.group(2)) if header_match.group(2) else 1,
+                "modified_count": int(header_match.group(4)) if header_match.group(4) else 1,
+                "kinds": bytearray(),
+                "payloads": [],
+            }
+            remaining_original, remaining_modified = current_hunk["original_count"], current_hunk["modified_count"]
             continue
 
         if current_hunk is not None:
-            current_hunk["lines"].append(line)
+            kind = line[:1]
+            next_line = diff_lines[line_number + 1] if line_number + 1 < len(diff_lines) else ""
+            line_after_next = diff_lines[line_number + 2] if line_number + 2 < len(diff_lines) else ""
+            if kind == " " or kind == "-" or kind == "+":
+                # Lines past the header counts are still applied, hand-edited and generated diffs often get the counts
+                # wrong. Only the next file's "---"/"+++"/"@@" header, or a "-- " mail signature once the counts are used up,
+                # end the hunk (a "---"/"+++" pair alone may just be a changed "-- comment" line). A signature on the last line has lost its
+                # trailing space to strip(), hence the bare "--".
+                counts_used_up = remaining_original <= 0 and remaining_modified <= 0
+                end_of_hunk = (line[:4] == "--- " and next_line[:4] == "+++ " and line_after_next[:2] == "@@") or (
+                    counts_used_up and (line[:4] == "--- " or line[:4] == "+++ " or line.rstrip("\r\n") in ("-- ", "--"))
+                )
+            elif kind == "\\": # "\ No newline at end of file" doesn't affect the result
+                continue
+            elif not line.strip():
+                if remaining_original > 0 and remaining_modified > 0:
+                    # Still inside the hunk, so this is a blank context line that lost its leading space when pasted
+                    # (GNU patch reads it the same way)
+                    kind, line, end_of_hunk = " ", " \n", False
+                else:
+                    # Past the counts blank lines are skipped, but one followed by non-diff content ends the hunk
+                    end_of_hunk = not (next_line[:1] in (" ", "+", "-", "\\") or next_line[:2] == "@@")
+                    if not end_of_hunk:
+                        continue
+            else: # Anything else (shell prompts, "diff --git", pasted text) is not part of the hunk
+                end_of_hunk = True
+
+            if end_of_hunk:
+                hunks.append(current_hunk)
+                current_hunk = None
+            elif kind == "+":
+                current_hunk["kinds"].append(_ADDED)
+                # Line ending normalised to "\n" so LF diffs (the common case) can be written out as-is
+                current_hunk["payloads"].append(line[1:] if line[-2:] != "\r\n" else line[1:-2] + "\n")
+                remaining_modified -= 1
+            else:
+                current_hunk["kinds"].append(ord(kind))
+                current_hunk["payloads"].append(line[1:].rstrip("\r\n")) # Without the line ending, for comparison with the original
+                remaining_original -= 1
+                if kind == " ":
+                    remaining_modified -= 1
 
     if current_hunk:
         hunks.append(current_hunk)
 
-    if not filename and not target_filename:
-        filename = "in-memory-content"
-
-    original_lines = original_content.splitlines(keepends=True) if original_content else []
+    # Split the same way as the diff, so lines holding a form feed etc. line up with it
+    original_lines = [line + "\n" for line in original_content.split("\n")] if original_content else []
+    if original_lines and original_lines[-1] == "\n": # Content ending in a newline has no line after it
+        original_lines.pop()
+    elif original_lines: # The last line has no trailing newline
+        original_lines[-1] = original_lines[-1][:-1]
+    original_stripped = [l.rstrip("\r\n") for l in original_lines] # Compared against diff payloads
+    newline = "\r\n" if original_lines and original_lines[0].endswith("\r\n") else "\n" # Used for lines taken from the diff
     original_line_index = 0
-    new_lines = []
-    mismatches_warnings = []  # To collect mismatch warnings
+    output = io.StringIO()  # Output buffer, avoids building and joining a list of every line
+    mismatches = []  # To collect mismatches, formatted into warnings at the end
+    line_index = None  # Built on first use, only needed when a hunk header doesn't line up with the original
 
     for hunk in hunks:
-        header_match = re.match(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@.*", hunk["header"])
-        if not header_match:
-            return None, f"Warning: Invalid hunk header: '{hunk['header']}'. Skipping hunk.", None, None # Return None for modified_content in error case
-
-        original_start_line = int(header_match.group(1))
-        original_line_count = int(header_match.group(2)) if header_match.group(2) else 1
-        modified_start_line = int(header_match.group(3))
-        modified_line_count = int(header_match.group(4)) if header_match.group(4) else 1
-
-        original_start_line -= 1  # 0-indexed
-
-        # Copy unchanged lines before the hunk
-        while original_line_index < original_start_line and original_line_index < len(original_lines):
-            new_lines.append(original_lines[original_line_index])
-            original_line_index += 1
-
-        hunk_lines_index = 0
-        while hunk_lines_index < len(hunk["lines"]):
-            line = hunk["lines"][hunk_lines_index]
-
-            if line.startswith(" "):  # Context line
-                expected_original_line = line[1:].rstrip('\n')
-                actual_original_line = original_lines[original_line_index].rstrip('\n') if original_line_index < len(original_lines) else ''
-
-                if original_line_index < len(original_lines) and is_line_similar(actual_original_line, expected_original_line):
-                    new_lines.append(original_lines[original_line_index])
-                    original_line_index += 1
-                else:
-                    mismatches_warnings.append(f"Context line mismatch, using diff line anyway: '{line.strip()}' (Expected near line {original_start_line + 1 + hunk_lines_index}). Potential patching issue.")
-                    new_lines.append(line[1:] + '\n') # Apply diff line even if context mismatch
-
-
-            elif line.startswith("+"):  # Added line
-                new_lines.append(line[1:] + '\n')
-
-            elif line.startswith("-"):  # Removed line
-                if original_line_index < len(original_lines) and original_lines[original_line_index].rstrip('\n') != line[1:].rstrip('\n'):
-                     mismatches_warnings.append(f"Removal line context mismatch, skipping original line but applying removal from diff: '{line.strip()}' (Expected near line {original_start_line + 1 + hunk_lines_index}). Potential patching issue.")
-                original_line_index += 1 # Always try to skip original line for removal, even with mismatch
-
-            hunk_lines_index += 1
-
-        # Copy any remaining lines after the last hunk
-        while original_line_index < len(original_lines):
-            new_lines.append(original_lines[original_line_index])
-            original_line_index += 1
-
-    modified_content_string = "".join(new_lines)
-    if mismatches_warnings:
-        warning_message = "Patch applied with potential issues:\n" + "\n".join(mismatches_warnings)
-        return "Patch applied with warnings.", warning_message, modified_content_string, modified_content_string # Return modified_content also in warning case
+        original_start_line = hunk["original_start"]
+
+        # Sanity check the body against the header counts, bytearray.count() scans the kinds in C
+        kinds = hunk["kinds"]
+        context_count = kinds.count(_CONTEXT)
+        if (context_count + kinds.count(_REMOVED) != hunk["original_count"]
+                or context_count + kinds.count(_ADDED) != hunk["modified_count"]):
+            mismatches.append((_MISMATCH_HEADER, original_start_line + 1, hunk["header"]))
+
+        # If the hunk doesn't match exactly at its header position, look for it nearby
+        if not _hunk_matches_at(hunk, original_stripped, original_start_line):
+            if line_index is None:
+                line_index = _build_line_index(original_stripped)
+            original_start_line = _locate_hunk(hunk, line_index, original_stripped, original_start_line, original_line_index)
+
+        # Copy unchanged lines before the hunk in one go
+        if original_start_line > original_line_index:
+            output.writelines(original_lines[original_line_index:original_start_line])
+            original_line_index = min(original_start_line, len(original_lines))
+
+        original_line_index = _apply_hunk(hunk, original_lines, original_stripped, original_line_index, original_start_line, output, mismatches, newline)
+
+    # Copy any remaining lines after the last hunk
+    output.writelines(original_lines[original_line_index:])
+
+    modified_content_string = output.getvalue()
+    if mismatches:
+        warning_message = "Patch applied with potential issues:\n" + "\n".join(_format_mismatch(*mismatch) for mismatch in mismatches)
+        return "Patch applied with warnings.", warning_message, modified_content_string # Return modified_content also in warning case
     else:
-        return "Successfully applied patch.", None, modified_content_string, modified_content_string # Return modified_content in success case
+        return "Successfully applied patch.", None, modified_content_string # Return modified_content in success case
 
 
 # --- Display Functions ---
@@ -128,7 +314,7 @@ def display_header():
     st.write("Enter your diff content and the original text content to apply the patch. This version is more tolerant to slight variations in original content.")
 
 def display_input_fields():
-    original_content = st.text_area("Original Content", height=300, placeholder="Paste the original text content here...")
+    original_content = st.text_area("Original Content", height=300, placeholder="Paste the original text content here (leave empty to create a new file)...")
     diff_content = st.text_area("Diff Content", height=300, placeholder="Paste your diff content here...")
     filename = st.text_input("Filename (Optional, for reference)", placeholder="Enter filename if needed (or extracted from diff)")
     return original_content, diff_content, filename
@@ -154,10 +340,8 @@ def main():
     if st.button("Apply Patch (Smart)"):
         if not diff_content:
             st.error("Please provide diff content.")
-        elif not original_content:
-            st.error("Please provide original content to patch.")
         else:
-            success_message, warning_message, modified_content, _ = apply_diff_logic_smart(diff_content, original_content, filename) # Unpack only 3, ignore the 4th return
+            success_message, warning_message, modified_content = apply_diff_logic_smart(diff_content, original_content, filename)
             display_output(success_message, warning_message, modified_content) # Pass warning_message as the second argument
 
 
@@ -0,0 +1,134 @@
+from app import apply_diff_logic_smart, is_line_similar
+
+
+def test_crlf_diff_on_lf_original():
+    diff = "@@ -1,2 +1,3 @@\r\n a\r\n-b\r\n+X\r\n+Y\r\n"
+    success, warning, modified = apply_diff_logic_smart(diff, "a\nb\nc\n")
+    assert warning is None
+    assert modified == "a\nX\nY\nc\n"
+
+
+def test_lf_diff_on_crlf_original():
+    diff = "@@ -1,2 +1,2 @@\n a\n-b\n+X\n"
+    success, warning, modified = apply_diff_logic_smart(diff, "a\r\nb\r\nc\r\n")
+    assert warning is None
+    assert modified == "a\r\nX\r\nc\r\n"
+
+
+
+def test_multiple_hunks_apply_in_order():
+    original = "".join(f"line {i}\n" for i in range(1, 31))
+    diff = (
+        "@@ -2,3 +2,3 @@\n line 2\n-line 3\n+LINE 3\n line 4\n"
+        "@@ -20,3 +20,3 @@\n line 20\n-line 21\n+LINE 21\n line 22\n"
+    )
+    success, warning, modified = apply_diff_logic_smart(diff, original)
+    assert warning is None
+    assert modified == original.replace("line 3\n", "LINE 3\n").replace("line 21\n", "LINE 21\n")
+
+def test_similarity_follows_the_ratio():
+    assert not is_line_similar("foo(a, b, c, d, eeeeeeee)", "foo(a, b, c, d, ffffffff)")
+    assert not is_line_similar("a bb ccc dddd eeeee", "a bb ccc dddd zzzzz")
+    assert is_line_similar("return  value", "return value")
+    assert is_line_similar("value = compute(a)", "value = compute(ab)")
+    assert is_line_similar("import foo", "import fop")
+    assert is_line_similar("return foo_bar;", "return foo_baz;")
+    assert is_line_similar("self.assertEqual(x, 1)", "self.assertEqual(x, 2)")
+    assert is_line_similar("print('hello world')", "print('hello world!')")
+
+
+def test_fuzzy_context_line_is_kept():
+    original = "def fop(self):\n    a = 1\n    return a\n"
+    diff = "@@ -1,3 +1,3 @@\n def foo(self):\n-    a = 1\n+    a = 2\n     return a\n"
+    success, warning, modified = apply_diff_logic_smart(diff, original)
+    assert warning is None
+    assert modified == "def fop(self):\n    a = 2\n    return a\n"
+
+
+def test_hunk_stays_at_header_when_it_matches_fuzzily():
+    original = "l1\nl2\nl3\nl4\nl5\nreturn  value\nline5\nA\nB\nC\nD\nreturn value\nE\n"
+    diff = "@@ -6,2 +6,2 @@\n return value\n-line5\n+CHANGED\n"
+    success, warning, modified = apply_diff_logic_smart(diff, original)
+    assert warning is None
+    assert modified == "l1\nl2\nl3\nl4\nl5\nreturn  value\nCHANGED\nA\nB\nC\nD\nreturn value\nE\n"
+
+
+def test_hunk_is_moved_when_the_original_has_drifted():
+    original = "".join(f"line {i}\n" for i in range(1, 21))
+    diff = "@@ -5,3 +5,3 @@\n line 8\n-line 9\n+LINE 9\n line 10\n"
+    success, warning, modified = apply_diff_logic_smart(diff, original)
+    assert warning is None
+    assert modified == original.replace("line 9\n", "LINE 9\n")
+
+
+def test_new_file_patch_on_empty_original():
+    success, warning, modified = apply_diff_logic_smart("@@ -0,0 +1,2 @@\n+a\n+b\n", "")
+    assert warning is None
+    assert modified == "a\nb\n"
+
+
+def test_context_against_empty_original_warns():
+    success, warning, modified = apply_diff_logic_smart("@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n", "")
+    assert success == "Patch applied with warnings."
+    assert "Context line mismatch" in warning
+
+
+def test_lines_beyond_header_counts_are_still_applied():
+    diff = "@@ -1,2 +1,2 @@\n a\n-b\n+B\n c\n-d\n+D\n"
+    success, warning, modified = apply_diff_logic_smart(diff, "a\nb\nc\nd\n")
+    assert modified == "a\nB\nc\nD\n"
+    assert "Hunk line counts don't match" in warning
+
+
+def test_trailing_signature_and_file_headers_end_hunks():
+    original = "".join(f"line {i}\n" for i in range(1, 11))
+    diff = (
+        "--- a/f\n+++ b/f\n@@ -2,2 +2,2 @@\n line 2\n-line 3\n+LINE 3\n"
+        "--- g\n+++ g\n@@ -8,1 +8,1 @@\n-line 8\n+LINE 8\n-- \n2.39.0\n"
+    )
+    success, warning, modified = apply_diff_logic_smart(diff, original)
+    assert warning is None
+    assert modified == original.replace("line 3\n", "LINE 3\n").replace("line 8\n", "LINE 8\n")
+
+
+def test_form_feed_lines_are_not_split():
+    diff = "@@ -1,2 +1,3 @@\n a\n+\x0c\n b\n"
+    assert apply_diff_logic_smart(diff, "a\nb\n")[2] == "a\n\x0c\nb\n"
+    assert apply_diff_logic_smart(diff, "a\r\nb\r\n")[2] == "a\r\n\x0c\r\nb\r\n"
+    assert apply_diff_logic_smart("@@ -1,2 +1,2 @@\n-\x0c\n+x\n b\n", "\x0c\nb")[2] == "x\nb"
+
+
+def test_exact_match_nearby_wins_over_fuzzy_match_at_header():
+    original = "".join(f"# header {i}\n" for i in range(30)) + "".join(
+        f"    value_{i} = compute(a, b, {i})\n" for i in range(1, 601)
+    )
+    diff = (
+        "@@ -511,3 +511,3 @@\n"
+        "     value_510 = compute(a, b, 510)\n"
+        "-    value_511 = compute(a, b, 511)\n"
+        "+    value_511 = compute(a, b, -1)\n"
+        "     value_512 = compute(a, b, 512)\n"
+    )
+    success, warning, modified = apply_diff_logic_smart(diff, original)
+    assert warning is None
+    assert modified == original.replace("compute(a, b, 511)", "compute(a, b, -1)")
+
+
+def test_changed_double_dash_comment_is_not_a_file_header():
+    diff = "@@ -1,2 +1,2 @@\n a\n--- old\n+++ new\n"
+    success, warning, modified = apply_diff_logic_smart(diff, "a\n-- old\n")
+    assert warning is None
+    assert modified == "a\n++ new\n"
+
+
+def test_signature_on_the_last_line_ends_the_hunk():
+    success, warning, modified = apply_diff_logic_smart("@@ -1,2 +1,2 @@\n a\n-b\n+B\n-- \n", "a\nb\nc\n")
+    assert warning is None
+    assert modified == "a\nB\nc\n"
+
+
+def test_blank_line_inside_hunk_is_blank_context():
+    diff = "@@ -1,4 +1,4 @@\n a\n\n-b\n+B\n c\n"
+    success, warning, modified = apply_diff_logic_smart(diff, "a\n\nb\nc\n")
+    assert warning is None
+    assert modified == "a\n\nB\nc\n"